@@ -0,0 +1,21 @@
+# cython: language_level=3, boundscheck=False, wraparound=False
+"""
+Compiled version of app._clean_row (same behaviour, see there).
+"""
+
+
+cpdef tuple clean_row(list row):
+    cdef Py_ssize_t i
+    cdef Py_ssize_t n = len(row)
+    cdef Py_ssize_t end = 0
+    cdef list out = [None] * n
+    cdef object v
+
+    for i in range(n):
+        v = row[i]
+        if isinstance(v, str):
+            v = (<str>v).strip() or None
+        if v is not None:
+            out[i] = v
+            end = i + 1
+    return tuple(out[:end])
@@ -1,15 +1,32 @@
+import asyncio
+import hashlib
 import os
 import logging
+import queue
+import shutil
 import threading
+import time
 import traceback
-
-from flask import Flask, request
-
-import pdfplumber
-from openpyxl import Workbook
-
-from telegram import Bot, Update
-from telegram.ext import Dispatcher, MessageHandler, CommandHandler, Filters
+import uuid
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from collections import deque
+from contextlib import asynccontextmanager
+from functools import partial
+
+import requests
+from requests_toolbelt import MultipartEncoder
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+
+import pymupdf
+import xlsxwriter
+
+from telegram import Update
+from telegram.ext import ApplicationBuilder, CommandHandler, ContextTypes, MessageHandler, filters
 
 # -------------------------------------------------------------------
 # Logging setup
@@ -19,184 +36,563 @@ logging.basicConfig(
     format="%(asctime)s [%(levelname)s] %(name)s - %(message)s",
 )
 logger = logging.getLogger(__name__)
+# httpx (used by python-telegram-bot) logs every request URL at INFO, and those contain the token
+logging.getLogger("httpx").setLevel(logging.WARNING)
 
 # -------------------------------------------------------------------
-# Telegram / Flask setup
+# Telegram / ASGI setup
 # -------------------------------------------------------------------
 TOKEN = os.getenv("BOT_TOKEN")
 if not TOKEN:
     raise RuntimeError("BOT_TOKEN env var is not set")
 
-bot = Bot(TOKEN)
-app = Flask(__name__)
+# Handlers running at once; a slow download/upload in one chat mustn't block the others
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "16"))
+
+# Updates arrive via our own webhook route, so no Updater.
+# Shared keep-alive connection pools so API calls don't pay a TLS handshake each time;
+# sized above CONCURRENT_UPDATES so job threads' progress edits still get a connection.
+application = (
+    ApplicationBuilder()
+    .token(TOKEN)
+    .updater(None)
+    .concurrent_updates(CONCURRENT_UPDATES)
+    .connection_pool_size(CONCURRENT_UPDATES + 8)
+    .connect_timeout(5)
+    .read_timeout(30)
+    .build()
+)
+bot = application.bot
+http = requests.Session()
 
-dispatcher = Dispatcher(bot, None, workers=0, use_context=True)
+# Event loop the bot runs on; set at startup so job threads can call into it
+main_loop = None
 
-# Active jobs: chat_id -> {"cancel_event": Event, "thread": Thread}
+# Active jobs: chat_id -> {"cancel_event": Event, "future": Future | None, "paths": (pdf, xlsx)}
+# No lock: only get/setdefault/pop are used, each of which is atomic under the GIL
 active_jobs = {}
-jobs_lock = threading.Lock()
 
 # Limits – tune these for Render free tier
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", "2"))          # conversions running at once
+MAX_QUEUED_JOBS = int(os.getenv("MAX_QUEUED_JOBS", "4"))  # waiting conversions before "busy"
 MAX_PAGES = 3000                  # hard safety limit on pages to process
 MAX_FILE_SIZE_BYTES = 20 * 1024 * 1024  # 20 MB – reject bigger PDFs
 PROGRESS_STEPS = 10               # how many times to update progress
+PROGRESS_MIN_INTERVAL = 2.0       # seconds between progress edits
+# Worker processes for table extraction, shared by all jobs. Defaults to the CPUs this
+# process may run on (os.cpu_count() reports the whole host).
+EXTRACT_PROCESSES = int(os.getenv("EXTRACT_PROCESSES", "0")) or (
+    len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 2
+)
+PAGES_PER_TASK = 8                # pages each worker extracts per task
+EXTRACT_WINDOW = 2 * EXTRACT_PROCESSES  # batches one job keeps in flight in the shared pool
+DOWNLOAD_CHUNK_SIZE = 1 << 20     # 1 MB chunks when streaming downloads
+DOWNLOAD_TIMEOUT = 60             # seconds
+UPLOAD_TIMEOUT = 120              # seconds
+BOT_CALL_TIMEOUT = 60             # seconds a job thread waits on a bot API call
+# Table detection settings, pinned explicitly (they match find_tables() defaults today)
+# so results stay stable if a PyMuPDF upgrade changes those defaults
+TABLE_SETTINGS = {
+    "vertical_strategy": "lines",
+    "horizontal_strategy": "lines",
+    "snap_tolerance": 3,
+    "join_tolerance": 3,
+    "edge_min_length": 3,
+    "min_words_vertical": 3,
+    "min_words_horizontal": 1,
+    "intersection_tolerance": 3,
+    "text_tolerance": 3,
+}
+TMPDIR = "/dev/shm" if os.path.isdir("/dev/shm") else "/tmp"  # RAM-backed when available
+TMPFS_MIN_FREE_BYTES = 32 * 1024 * 1024  # leave this much of TMPDIR free, else use /tmp
+XLSX_SCRATCH_DIR = "/tmp"         # disk-backed dir for xlsxwriter's scratch XML and the output xlsx
+XLSX_CACHE_DIR = "/tmp/xlsx_cache"  # converted files keyed by PDF SHA-256 (disk, not tmpfs)
+XLSX_CACHE_MAX_BYTES = 200 * 1024 * 1024  # evict least recently used beyond this
+XLSX_COMPRESS_LEVEL = 1           # zlib level for the xlsx zip (default 6 is much slower)
+XLSX_MIME_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+# xlsxwriter has no compression option; give its ZipFile a faster level.
+# Patched on xlsxwriter's module only, so other zipfile users are unaffected.
+if hasattr(xlsxwriter.workbook, "ZipFile"):
+    xlsxwriter.workbook.ZipFile = partial(zipfile.ZipFile, compresslevel=XLSX_COMPRESS_LEVEL)
+
+# Bounded pool for conversions so a burst of uploads can't exhaust RAM
+EXECUTOR = ThreadPoolExecutor(max_workers=PDF_WORKERS, thread_name_prefix="pdf-job")
+
+# One extraction pool for all jobs, so RAM doesn't scale with PDF_WORKERS × CPUs
+EXTRACT_EXECUTOR = ProcessPoolExecutor(max_workers=EXTRACT_PROCESSES)
+
+
+# -------------------------------------------------------------------
+# Sync bridge for job threads
+# -------------------------------------------------------------------
+def _run_sync(coro):
+    """
+    Runs a bot coroutine on the main event loop from a job thread and waits for the result.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, main_loop).result(timeout=BOT_CALL_TIMEOUT)
+
+
+# -------------------------------------------------------------------
+# File helpers
+# -------------------------------------------------------------------
+def _redact_token(text: str) -> str:
+    """
+    Removes the bot token from text that may end up in logs (request URLs contain it).
+    """
+    return text.replace(TOKEN, "<BOT_TOKEN>")
+
+
+def _download_file(file_path: str, dest_path: str) -> None:
+    """
+    Streams a Telegram file to disk in 1 MB chunks instead of one big write.
+    Request errors are re-raised without the URL, which contains the bot token.
+    """
+    url = file_path
+    if not url.startswith("http"):
+        url = f"https://api.telegram.org/file/bot{TOKEN}/{file_path}"
+
+    try:
+        with http.get(url, stream=True, timeout=DOWNLOAD_TIMEOUT) as r:
+            r.raise_for_status()
+            with open(dest_path, "wb", buffering=0) as f:
+                for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    f.write(chunk)
+    except requests.RequestException as e:
+        # "from None" so the original exception (and its URL) isn't chained into tracebacks
+        raise RuntimeError(
+            f"File download failed: {type(e).__name__}: {_redact_token(str(e))}"
+        ) from None
+
+
+def _send_document(chat_id: int, path: str, caption: str, filename: str = None) -> None:
+    """
+    Uploads a file via sendDocument, streaming it from disk in blocks
+    instead of reading the whole file into memory first.
+    Request errors are re-raised without the URL, which contains the bot token.
+    """
+    try:
+        with open(path, "rb") as f:
+            enc = MultipartEncoder(
+                {
+                    "chat_id": str(chat_id),
+                    "caption": caption,
+                    "document": (filename or os.path.basename(path), f, XLSX_MIME_TYPE),
+                }
+            )
+            r = http.post(
+                f"https://api.telegram.org/bot{TOKEN}/sendDocument",
+                data=enc,
+                headers={"Content-Type": enc.content_type},
+                timeout=UPLOAD_TIMEOUT,
+            )
+        r.raise_for_status()
+    except requests.RequestException as e:
+        raise RuntimeError(
+            f"sendDocument failed: {type(e).__name__}: {_redact_token(str(e))}"
+        ) from None
+
+
+def _drop_page_cache(path: str) -> None:
+    """
+    Asks the kernel to evict a temp file from the page cache (no-op where unsupported).
+    """
+    if not hasattr(os, "posix_fadvise"):
+        return
+    try:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+    except OSError as e:
+        logger.debug("posix_fadvise failed for %s: %s", path, e)
+
+
+def _pdf_temp_dir(size: int) -> str:
+    """
+    Picks where to download a PDF: tmpfs (TMPDIR) only while it keeps
+    TMPFS_MIN_FREE_BYTES to spare after this file, otherwise disk-backed /tmp.
+    tmpfs is small (64 MB by default in Docker) and counts against RAM.
+    """
+    if TMPDIR != "/tmp":
+        try:
+            if shutil.disk_usage(TMPDIR).free - size >= TMPFS_MIN_FREE_BYTES:
+                return TMPDIR
+        except OSError:
+            pass
+    return "/tmp"
+
+
+def _file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for blk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b""):
+            h.update(blk)
+    return h.hexdigest()
+
+
+def _cache_lookup(sha: str):
+    """
+    Returns the cached xlsx path for a PDF hash, or None on a miss.
+    Bumps the file's mtime so eviction is least-recently-used.
+    """
+    cache_path = os.path.join(XLSX_CACHE_DIR, f"{sha}.xlsx")
+    try:
+        os.utime(cache_path)
+    except OSError:
+        return None
+    return cache_path
+
+
+def _cache_store(sha: str, excel_path: str) -> None:
+    """
+    Moves a finished xlsx into the cache, then evicts the oldest entries
+    until the cache fits in XLSX_CACHE_MAX_BYTES.
+    """
+    try:
+        os.makedirs(XLSX_CACHE_DIR, exist_ok=True)
+        cache_path = os.path.join(XLSX_CACHE_DIR, f"{sha}.xlsx")
+        # The xlsx may be on another filesystem, so move to a temp name first and rename atomically
+        tmp_path = f"{cache_path}.{threading.get_ident()}.tmp"
+        shutil.move(excel_path, tmp_path)
+        os.replace(tmp_path, cache_path)
+
+        entries = []
+        for entry in os.scandir(XLSX_CACHE_DIR):
+            if entry.name.endswith(".xlsx"):
+                st = entry.stat()
+                entries.append((st.st_mtime, st.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= XLSX_CACHE_MAX_BYTES:
+                break
+            os.remove(path)
+            total -= size
+    except Exception as e:
+        logger.warning("Failed to store result in cache: %s", e)
+
+
+def _remove_temp_files(*paths: str) -> None:
+    try:
+        for path in paths:
+            if os.path.exists(path):
+                _drop_page_cache(path)
+                os.remove(path)
+    except Exception as e:
+        logger.warning("Failed to delete temp files: %s", e)
 
 
 # -------------------------------------------------------------------
 # Background worker: PDF -> Excel with low memory use
 # -------------------------------------------------------------------
+def _extract_page_tables(args) -> list:
+    """
+    Runs in a worker process.
+    Returns the rows of every table found on each page in [first, last), or None per page.
+    """
+    pdf_path, first, last = args
+    tables = []
+    with pymupdf.open(pdf_path) as doc:
+        for i in range(first, last):
+            try:
+                page = doc.load_page(i)
+                # Scanned/image-only pages reference no fonts, so there's no text to find a table in
+                if not page.get_fonts():
+                    rows = None
+                else:
+                    rows = [
+                        row for tbl in page.find_tables(**TABLE_SETTINGS) for row in tbl.extract()
+                    ]
+            except Exception as e:
+                logger.exception("Error extracting table on page %s: %s", i + 1, e)
+                rows = None
+            tables.append(rows)
+            # Drop the page reference so MuPDF can free it before the next one
+            page = None
+    return tables
+
+
+def _iter_page_tables(extract_executor, tasks: list, cancel_event: threading.Event):
+    """
+    Yields each page's tables in order, keeping at most EXTRACT_WINDOW batches
+    in flight so finished results are freed as they're consumed and other jobs
+    get a turn in the shared pool. Stops (without submitting more) once
+    cancel_event is set; pending batches are cancelled when the generator closes.
+    """
+    tasks = iter(tasks)
+    in_flight = deque()
+    try:
+        while not cancel_event.is_set():
+            while len(in_flight) < EXTRACT_WINDOW:
+                task = next(tasks, None)
+                if task is None:
+                    break
+                in_flight.append(extract_executor.submit(_extract_page_tables, task))
+            if not in_flight:
+                return
+            for tables in in_flight.popleft().result():
+                if cancel_event.is_set():
+                    return
+                yield tables
+    finally:
+        for future in in_flight:
+            future.cancel()
+
+
+def _reset_extract_executor(broken: ProcessPoolExecutor) -> None:
+    """
+    Replaces the shared extraction pool after a worker died (e.g. OOM-killed),
+    otherwise every later job would fail with BrokenProcessPool.
+    """
+    global EXTRACT_EXECUTOR
+    if EXTRACT_EXECUTOR is broken:
+        logger.warning("Extraction process pool broke; starting a new one")
+        EXTRACT_EXECUTOR = ProcessPoolExecutor(max_workers=EXTRACT_PROCESSES)
+
+
+def _clean_row(row: list) -> tuple:
+    """
+    Strips whitespace from string cells (blank strings become None) and drops
+    trailing empty cells so the writer doesn't emit a cell for each.
+    Returns an empty tuple for rows with no values at all.
+    Pure-Python fallback for _rowclean.clean_row.
+    """
+    out = []
+    end = 0
+    for v in row:
+        if isinstance(v, str):
+            v = v.strip() or None
+        out.append(v)
+        if v is not None:
+            end = len(out)
+    return tuple(out[:end])
+
+
+# Compiled row cleaner for the hot write loop; fall back if Cython/a compiler is unavailable
+try:
+    import pyximport
+
+    pyximport.install(language_level=3)
+    from _rowclean import clean_row
+except Exception as e:
+    logger.info("Using pure-Python row cleaner (%s)", e)
+    clean_row = _clean_row
+
+
+def _progress_worker(progress_q: queue.Queue, chat_id: int, status_message_id: int) -> None:
+    """
+    Runs in its own thread.
+    Applies queued progress texts to the status message until it receives None.
+    """
+    while True:
+        text = progress_q.get()
+        if text is None:
+            return
+        try:
+            _run_sync(
+                bot.edit_message_text(
+                    chat_id=chat_id,
+                    message_id=status_message_id,
+                    text=text,
+                )
+            )
+        except Exception as e:
+            logger.warning("Failed to edit progress message: %s", e)
+
+
+def _stop_progress_worker(progress_q: queue.Queue, progress_thread: threading.Thread) -> None:
+    progress_q.put(None)
+    progress_thread.join()
+
+
 def process_pdf_async(
     chat_id: int,
     status_message_id: int,
     pdf_path: str,
     excel_path: str,
     cancel_event: threading.Event,
+    pdf_sha: str = None,
+    xlsx_name: str = None,
 ) -> None:
     """
-    Runs in a background thread.
-    Reads PDF page-by-page and writes directly to an Excel workbook.
-    Avoids building huge lists in RAM.
+    Runs in the EXECUTOR thread pool.
+    Extracts tables in a process pool and writes rows directly to an Excel workbook.
+    Avoids building huge lists in RAM. Successful results are cached under pdf_sha.
+    xlsx_name is the file name the user receives (temp paths are unique per job).
     """
     logger.info("Starting background job for chat_id=%s, pdf=%s", chat_id, pdf_path)
     try:
-        bot.edit_message_text(
-            chat_id=chat_id,
-            message_id=status_message_id,
-            text="Processing your PDF… ⏳",
+        _run_sync(
+            bot.edit_message_text(
+                chat_id=chat_id,
+                message_id=status_message_id,
+                text="Processing your PDF… ⏳",
+            )
         )
 
-        # Create workbook in memory (more efficient than pandas DataFrame for big data)
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Data"
-
         total_pages_to_process = 0
 
-        with pdfplumber.open(pdf_path) as pdf:
-            total_pages = len(pdf.pages)
-            if total_pages == 0:
+        with pymupdf.open(pdf_path) as doc:
+            total_pages = doc.page_count
+
+        if total_pages == 0:
+            _run_sync(
                 bot.edit_message_text(
                     chat_id=chat_id,
                     message_id=status_message_id,
                     text="⚠️ This PDF seems to be empty.",
                 )
-                return
-
-            if total_pages > MAX_PAGES:
-                logger.warning(
-                    "PDF too large: %s pages for chat_id=%s. Limiting to %s pages.",
-                    total_pages,
-                    chat_id,
-                    MAX_PAGES,
-                )
+            )
+            return
 
-            total_pages_to_process = min(total_pages, MAX_PAGES)
+        if total_pages > MAX_PAGES:
+            logger.warning(
+                "PDF too large: %s pages for chat_id=%s. Limiting to %s pages.",
+                total_pages,
+                chat_id,
+                MAX_PAGES,
+            )
 
-            step = max(1, total_pages_to_process // PROGRESS_STEPS)
+        total_pages_to_process = min(total_pages, MAX_PAGES)
 
-            for i in range(total_pages_to_process):
-                if cancel_event.is_set():
-                    logger.info("Job cancelled by user, chat_id=%s", chat_id)
-                    bot.edit_message_text(
-                        chat_id=chat_id,
-                        message_id=status_message_id,
-                        text=f"❌ Conversion cancelled at page {i}/{total_pages_to_process}.",
-                    )
-                    return
+        step = max(1, total_pages_to_process // PROGRESS_STEPS)
 
-                page_num = i + 1
-                page = pdf.pages[i]
+        # constant_memory mode writes each row straight to XML and only keeps the current one in RAM.
+        # Its uncompressed sheet XML can be far bigger than the PDF, so keep it on disk, not tmpfs.
+        wb = xlsxwriter.Workbook(
+            excel_path,
+            {"constant_memory": True, "tmpdir": XLSX_SCRATCH_DIR, "strings_to_numbers": False},
+        )
+        ws = wb.add_worksheet("Data")
+        row_idx = 0
+
+        # Extract tables in worker processes, write rows here (the workbook isn't thread-safe)
+        tasks = [
+            (pdf_path, first, min(first + PAGES_PER_TASK, total_pages_to_process))
+            for first in range(0, total_pages_to_process, PAGES_PER_TASK)
+        ]
+        extract_executor = EXTRACT_EXECUTOR
+        page_tables = _iter_page_tables(extract_executor, tasks, cancel_event)
+
+        # Progress edits go through a background thread so extraction never waits on the network
+        progress_q = queue.Queue(maxsize=1)
+        progress_thread = threading.Thread(
+            target=_progress_worker,
+            args=(progress_q, chat_id, status_message_id),
+            daemon=True,
+        )
+        progress_thread.start()
+        last_edit_ts = 0.0
 
-                try:
-                    table = page.extract_table()
-                except Exception as e:
-                    logger.exception(
-                        "Error extracting table on page %s for chat_id=%s: %s",
-                        page_num,
-                        chat_id,
-                        e,
-                    )
-                    table = None
+        try:
+            page_num = 0
+            # Submits happen lazily in here, so a broken pool is caught below
+            for table in page_tables:
+                page_num += 1
 
                 if table:
                     for row in table:
-                        # row is a list of cell values
-                        ws.append(row)
-
-                # Update progress
-                if page_num % step == 0 or page_num == total_pages_to_process:
+                        row = clean_row(row)
+                        if not row:
+                            # Bad extraction output: nothing but empty cells
+                            continue
+                        ws.write_row(row_idx, 0, row)
+                        row_idx += 1
+
+                # Update progress (Telegram rate-limits edits anyway)
+                now = time.monotonic()
+                if (
+                    page_num % step == 0 or page_num == total_pages_to_process
+                ) and now - last_edit_ts >= PROGRESS_MIN_INTERVAL:
+                    last_edit_ts = now
                     percent = int(page_num * 100 / total_pages_to_process)
                     try:
-                        bot.edit_message_text(
-                            chat_id=chat_id,
-                            message_id=status_message_id,
-                            text=(
-                                f"Processing… {percent}% done ⏳ "
-                                f"({page_num}/{total_pages_to_process} pages)"
-                            ),
+                        progress_q.put_nowait(
+                            f"Processing… {percent}% done ⏳ "
+                            f"({page_num}/{total_pages_to_process} pages)"
                         )
-                    except Exception as e:
-                        logger.warning("Failed to edit progress message: %s", e)
+                    except queue.Full:
+                        pass
+        except BrokenProcessPool:
+            _reset_extract_executor(extract_executor)
+            raise
+        finally:
+            # Drop this job's queued batches after a cancel or error (the pool is shared)
+            page_tables.close()
+            # Flush progress before any final status edit so it can't overwrite it
+            _stop_progress_worker(progress_q, progress_thread)
+            # Finish the xlsx on disk (a partial file is removed in cleanup)
+            wb.close()
+
+        if cancel_event.is_set() and page_num < total_pages_to_process:
+            logger.info("Job cancelled by user, chat_id=%s", chat_id)
+            _run_sync(
+                bot.edit_message_text(
+                    chat_id=chat_id,
+                    message_id=status_message_id,
+                    text=f"❌ Conversion cancelled at page {page_num}/{total_pages_to_process}.",
+                )
+            )
+            return
 
-        # If no rows wrote to sheet (only header exists or nothing at all)
-        if ws.max_row == 1 and all(cell.value is None for cell in ws[1]):
+        # If no rows were written to the sheet
+        if row_idx == 0:
+            _run_sync(
+                bot.edit_message_text(
+                    chat_id=chat_id,
+                    message_id=status_message_id,
+                    text="⚠️ I couldn't detect any tables in this PDF.",
+                )
+            )
+            return
+
+        _run_sync(
             bot.edit_message_text(
                 chat_id=chat_id,
                 message_id=status_message_id,
-                text="⚠️ I couldn't detect any tables in this PDF.",
+                text="✅ Conversion complete! Sending your Excel file…",
             )
-            return
-
-        # Save workbook to disk
-        wb.save(excel_path)
-
-        bot.edit_message_text(
-            chat_id=chat_id,
-            message_id=status_message_id,
-            text="✅ Conversion complete! Sending your Excel file…",
         )
 
-        with open(excel_path, "rb") as f:
-            bot.send_document(
-                chat_id=chat_id,
-                document=f,
-                filename=os.path.basename(excel_path),
-                caption="Here is your converted Excel file 😊",
-            )
+        _send_document(
+            chat_id,
+            excel_path,
+            caption="Here is your converted Excel file 😊",
+            filename=xlsx_name,
+        )
 
         logger.info("Job completed successfully for chat_id=%s", chat_id)
 
+        if pdf_sha:
+            _cache_store(pdf_sha, excel_path)
+
     except Exception as e:
         logger.error("Unhandled error in background job: %s", e)
         logger.error(traceback.format_exc())
         try:
-            bot.edit_message_text(
-                chat_id=chat_id,
-                message_id=status_message_id,
-                text="❌ An error occurred while converting your PDF. Please try again later.",
+            _run_sync(
+                bot.edit_message_text(
+                    chat_id=chat_id,
+                    message_id=status_message_id,
+                    text="❌ An error occurred while converting your PDF. Please try again later.",
+                )
             )
         except Exception as inner_e:
             logger.warning("Failed to edit message after error: %s", inner_e)
     finally:
         # Cleanup
-        with jobs_lock:
-            active_jobs.pop(chat_id, None)
-        try:
-            if os.path.exists(pdf_path):
-                os.remove(pdf_path)
-            if os.path.exists(excel_path):
-                os.remove(excel_path)
-        except Exception as e:
-            logger.warning("Failed to delete temp files: %s", e)
+        active_jobs.pop(chat_id, None)
+        _remove_temp_files(pdf_path, excel_path)
 
 
 # -------------------------------------------------------------------
 # Handlers
 # -------------------------------------------------------------------
-def start(update, context):
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
     logger.info("/start from chat_id=%s", chat_id)
-    update.message.reply_text(
+    await update.message.reply_text(
         "Hi! 👋\n\n"
         "Send me a *PDF with tables* and I’ll convert it to Excel 📊\n"
         "You can send /stop to cancel a running conversion.\n\n"
@@ -205,22 +601,30 @@ def start(update, context):
     )
 
 
-def stop(update, context):
+async def stop(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
     logger.info("/stop from chat_id=%s", chat_id)
 
-    with jobs_lock:
-        job = active_jobs.get(chat_id)
-
+    job = active_jobs.get(chat_id)
     if not job:
-        update.message.reply_text("There is no active conversion to stop 🙂")
+        await update.message.reply_text("There is no active conversion to stop 🙂")
         return
 
     job["cancel_event"].set()
-    update.message.reply_text("🛑 Stop requested. I’ll cancel the current conversion.")
+
+    # Still queued: it will never run, so clean up here.
+    # (No future yet means it's still downloading; it will see cancel_event once it starts.)
+    future = job["future"]
+    if future is not None and future.cancel():
+        active_jobs.pop(chat_id, None)
+        _remove_temp_files(*job["paths"])
+        await update.message.reply_text("🛑 Your queued conversion was cancelled.")
+        return
+
+    await update.message.reply_text("🛑 Stop requested. I’ll cancel the current conversion.")
 
 
-def handle_pdf(update, context):
+async def handle_pdf(update: Update, context: ContextTypes.DEFAULT_TYPE):
     message = update.message
     chat_id = message.chat.id
     document = message.document
@@ -233,13 +637,13 @@ def handle_pdf(update, context):
     )
 
     if not document.file_name.lower().endswith(".pdf"):
-        message.reply_text("Please upload a PDF file 😄")
+        await message.reply_text("Please upload a PDF file 😄")
         return
 
     # File size limit to avoid OOM on Render
     if document.file_size and document.file_size > MAX_FILE_SIZE_BYTES:
         mb = MAX_FILE_SIZE_BYTES // (1024 * 1024)
-        message.reply_text(
+        await message.reply_text(
             f"⚠️ This PDF is too large for this bot (limit ~{mb} MB).\n"
             "Please split the file or process it in parts."
         )
@@ -250,82 +654,140 @@ def handle_pdf(update, context):
         )
         return
 
-    with jobs_lock:
-        existing = active_jobs.get(chat_id)
-        if existing:
-            message.reply_text(
-                "⚠️ You already have a conversion running.\n"
-                "Send /stop to cancel it before starting a new one."
-            )
-            return
-
-    # Download PDF to /tmp
-    pdf_path = f"/tmp/{document.file_name}"
-    excel_path = pdf_path.replace(".pdf", ".xlsx")
+    # Unique temp names per job: uploads with the same file name must never share a file.
+    # The user's file name is only used for the document sent back.
+    job_id = f"{chat_id}-{uuid.uuid4().hex}"
+    pdf_dir = _pdf_temp_dir(document.file_size or MAX_FILE_SIZE_BYTES)
+    pdf_path = f"{pdf_dir}/{job_id}.pdf"
+    # The xlsx isn't bounded by the PDF size limit, so it always goes to disk
+    excel_path = f"{XLSX_SCRATCH_DIR}/{job_id}.xlsx"
+    xlsx_name = os.path.splitext(document.file_name)[0] + ".xlsx"
+
+    # Claim this chat's slot atomically; it's released below unless a job gets submitted
+    job = {
+        "cancel_event": threading.Event(),
+        "future": None,
+        "paths": (pdf_path, excel_path),
+    }
+    if active_jobs.setdefault(chat_id, job) is not job:
+        await message.reply_text(
+            "⚠️ You already have a conversion running.\n"
+            "Send /stop to cancel it before starting a new one."
+        )
+        return
 
     try:
-        file = document.get_file()
-        file.download(pdf_path)
-        logger.info("Downloaded PDF to %s for chat_id=%s", pdf_path, chat_id)
-    except Exception as e:
-        logger.error("Error downloading file: %s", e)
-        message.reply_text("❌ Failed to download the PDF from Telegram.")
-        return
+        # Backpressure: don't accept more work than the pool can reasonably queue
+        if EXECUTOR._work_queue.qsize() >= MAX_QUEUED_JOBS:
+            await message.reply_text("⚠️ Server busy right now. Please try again in a few minutes.")
+            logger.warning("Rejected file from chat_id=%s: job queue is full", chat_id)
+            return
 
-    status_message = message.reply_text("Starting PDF processing… ⏳")
-    status_message_id = status_message.message_id
+        # Download PDF to the temp dir
+        try:
+            file = await document.get_file()
+            # Blocking streamed download, so keep it off the event loop
+            await asyncio.to_thread(_download_file, file.file_path, pdf_path)
+            logger.info("Downloaded PDF to %s for chat_id=%s", pdf_path, chat_id)
+            pdf_sha = await asyncio.to_thread(_file_sha256, pdf_path)
+        except Exception as e:
+            logger.error("Error downloading file: %s", e)
+            await message.reply_text("❌ Failed to download the PDF from Telegram.")
+            return
 
-    cancel_event = threading.Event()
-    thread = threading.Thread(
-        target=process_pdf_async,
-        args=(chat_id, status_message_id, pdf_path, excel_path, cancel_event),
-        daemon=True,
-    )
+        # Same PDF converted before: send the cached workbook instead of re-extracting
+        cache_path = _cache_lookup(pdf_sha)
+        if cache_path:
+            logger.info("Cache hit for chat_id=%s, sha256=%s", chat_id, pdf_sha)
+            try:
+                await asyncio.to_thread(
+                    _send_document,
+                    chat_id,
+                    cache_path,
+                    "Here is your converted Excel file 😊",
+                    xlsx_name,
+                )
+                return
+            except Exception as e:
+                logger.warning("Failed to send cached file, converting again: %s", e)
 
-    with jobs_lock:
-        active_jobs[chat_id] = {
-            "cancel_event": cancel_event,
-            "thread": thread,
-        }
+        status_message = await message.reply_text("Starting PDF processing… ⏳")
+        status_message_id = status_message.message_id
 
-    thread.start()
-    logger.info("Background thread started for chat_id=%s", chat_id)
+        job["future"] = EXECUTOR.submit(
+            process_pdf_async,
+            chat_id,
+            status_message_id,
+            pdf_path,
+            excel_path,
+            job["cancel_event"],
+            pdf_sha,
+            xlsx_name,
+        )
+    finally:
+        if job["future"] is None:
+            # Never handed to the pool, so the job's own cleanup won't run
+            active_jobs.pop(chat_id, None)
+            _remove_temp_files(pdf_path)
+
+    logger.info("Conversion job submitted for chat_id=%s", chat_id)
 
 
 # -------------------------------------------------------------------
 # Register handlers
 # -------------------------------------------------------------------
-dispatcher.add_handler(CommandHandler("start", start))
-dispatcher.add_handler(CommandHandler("stop", stop))
-dispatcher.add_handler(MessageHandler(Filters.document.pdf, handle_pdf))
+application.add_handler(CommandHandler("start", start))
+application.add_handler(CommandHandler("stop", stop))
+application.add_handler(MessageHandler(filters.Document.PDF, handle_pdf))
 
 
 # -------------------------------------------------------------------
-# Flask routes
+# ASGI routes
 # -------------------------------------------------------------------
-@app.route("/")
-def home():
-    return "🚀 Telegram PDF→Excel bot is running."
+async def home(request: Request):
+    return PlainTextResponse("🚀 Telegram PDF→Excel bot is running.")
 
 
-@app.route(f"/webhook/{TOKEN}", methods=["POST"])
-def webhook():
+async def webhook(request: Request):
     try:
-        json_update = request.get_json(force=True, silent=True)
+        json_update = await request.json()
         if not json_update:
             logger.warning("Received empty update")
-            return "no update", 200
+            return PlainTextResponse("no update")
 
         update = Update.de_json(json_update, bot)
         logger.info("Received update: update_id=%s", update.update_id)
 
-        dispatcher.process_update(update)
+        # Processed by the running Application; return right away
+        await application.update_queue.put(update)
     except Exception as e:
         logger.error("Error in webhook handler: %s", e)
         logger.error(traceback.format_exc())
-    return "ok", 200
+    return PlainTextResponse("ok")
+
+
+@asynccontextmanager
+async def lifespan(app: Starlette):
+    global main_loop
+    main_loop = asyncio.get_running_loop()
+    async with application:
+        await application.start()
+        yield
+        await application.stop()
+
+
+app = Starlette(
+    routes=[
+        Route("/", home),
+        Route(f"/webhook/{TOKEN}", webhook, methods=["POST"]),
+    ],
+    lifespan=lifespan,
+)
 
 
 if __name__ == "__main__":
+    import uvicorn
+
     port = int(os.getenv("PORT", "10000"))
-    app.run(host="0.0.0.0", port=port, debug=True)
+    # No access log: the webhook path contains the bot token
+    uvicorn.run(app, host="0.0.0.0", port=port, access_log=False)